@@ -1,10 +1,17 @@
 # aggregator.py (versão final, orientada a eventos, sem EXPIRY)
 
 import asyncio
+import json
+import os
+import time
 from collections import defaultdict
 from .presence import check_presence
 from .dispatcher import dispatch_event
 from .models import SessionLocal, Embarcado, Bed
+from .config import AGGREGATOR_CHECKPOINT_PATH, CHECKPOINT_INTERVAL_SEC, CHECKPOINT_MAX_AGE_SEC, NETWORK_RANGES
+from .log import get_logger
+
+log = get_logger(__name__)
 
 # --- Configurações ---
 # Frequência para tentar novamente a verificação de MAC (em segundos)
@@ -15,12 +22,46 @@ _buffer = []
 _beds_in_process = set()
 # Dicionário para rastrear tarefas de retry de MAC pendentes {cama_nome: asyncio.Task}
 _pending_mac_checks = {} 
+# Evento original de cada retry pendente {cama_nome: evt}, usado no checkpoint
+_pending_retry_events = {}
+# Último conteúdo gravado no checkpoint e quando
+_last_checkpoint = None
+_last_checkpoint_at = 0.0
 
 def enqueue_event(evt):
     """ Coloca um novo evento no buffer. """
     # Não precisamos de timestamp aqui, já que não há mais expiração
     _buffer.append(evt)
-    print(f"[aggregator] enqueue: {evt}")
+    log.debug("enqueue", evt=evt)
+
+
+def _start_retry(cama_nome: str, event_data: dict):
+    """ Cria a tarefa de retry para a cama e registra o evento para o checkpoint. """
+    _pending_retry_events[cama_nome] = event_data
+    _pending_mac_checks[cama_nome] = asyncio.create_task(retry_mac_check(cama_nome, event_data))
+
+
+def _cancel_retry(cama_nome: str):
+    """ Cancela a tarefa de retry pendente da cama; retorna True se havia uma. """
+    _pending_retry_events.pop(cama_nome, None)
+    task = _pending_mac_checks.pop(cama_nome, None)
+    if task is None:
+        return False
+    task.cancel()
+    return True
+
+
+def _associate_found_bed(db, cama_nome: str, bed, event_data: dict):
+    """ Cama do retry apareceu na rede: associa ao quarto do ESP original e despacha. """
+    emb = db.query(Embarcado).filter(Embarcado.id_esp == event_data["esp_id"]).first()
+    if emb and bed.quarto is None:
+        log.info("retry: associando cama", cama=cama_nome, quarto=emb.quarto)
+        bed.quarto = emb.quarto
+        db.commit()
+        # Despacha o evento original
+        dispatch_payload = event_data.copy()
+        dispatch_payload.update({"quarto": bed.quarto, "status": "GET", "mac_address": bed.mac_address})
+        dispatch_event(dispatch_payload)
 
 
 async def retry_mac_check(cama_nome: str, event_data: dict):
@@ -28,7 +69,7 @@ async def retry_mac_check(cama_nome: str, event_data: dict):
     Tarefa de longa duração que verifica a presença de um MAC em baixa frequência.
     Esta tarefa só termina se encontrar o MAC ou for cancelada.
     """
-    print(f"[aggregator-retry] Iniciada tarefa de verificação para '{cama_nome}'. Frequência: {RETRY_PRESENCE_FREQUENCY_SEC}s.")
+    log.info("retry iniciado", cama=cama_nome, freq_sec=RETRY_PRESENCE_FREQUENCY_SEC)
     
     while True:
         await asyncio.sleep(RETRY_PRESENCE_FREQUENCY_SEC)
@@ -37,29 +78,21 @@ async def retry_mac_check(cama_nome: str, event_data: dict):
         try:
             bed = db.query(Bed).filter(Bed.nome_cama == cama_nome).first()
             if not bed:
-                print(f"[aggregator-retry] Cama '{cama_nome}' não encontrada na DB. Cancelando retry.")
+                log.warning("retry cancelado: cama não encontrada na DB", cama=cama_nome)
                 break
 
-            print(f"[aggregator-retry] Tentando verificar presença de '{cama_nome}' (MAC: {bed.mac_address}).")
+            log.debug("retry verificando presença", cama=cama_nome, mac=bed.mac_address)
             if check_presence(bed.mac_address):
-                print(f"[aggregator-retry] SUCESSO! Cama '{cama_nome}' encontrada na rede.")
+                log.info("retry: cama encontrada na rede", cama=cama_nome)
                 # Cama apareceu! Realiza a lógica de associação.
-                emb = db.query(Embarcado).filter(Embarcado.id_esp == event_data["esp_id"]).first()
-                if emb and bed.quarto is None:
-                    print(f"[aggregator-retry] Associando cama '{cama_nome}' via retry ao quarto '{emb.quarto}'.")
-                    bed.quarto = emb.quarto
-                    db.commit()
-                    # Despacha o evento original
-                    dispatch_payload = event_data.copy()
-                    dispatch_payload.update({"quarto": bed.quarto, "status": "GET", "mac_address": bed.mac_address})
-                    dispatch_event(dispatch_payload)
+                _associate_found_bed(db, cama_nome, bed, event_data)
                 break # Termina a tarefa de retry com sucesso
         finally:
             db.close()
 
-    if cama_nome in _pending_mac_checks:
-        del _pending_mac_checks[cama_nome]
-    print(f"[aggregator-retry] Finalizada tarefa de verificação para '{cama_nome}'.")
+    _pending_mac_checks.pop(cama_nome, None)
+    _pending_retry_events.pop(cama_nome, None)
+    log.info("retry finalizado", cama=cama_nome)
 
 
 async def process_bed_events(cama_nome: str):
@@ -75,15 +108,13 @@ async def process_bed_events(cama_nome: str):
 
         # --- LÓGICA DE 'OUT' EXPLÍCITO ---
         if any(e.get("status") == "OUT" for e in events_for_bed):
-            if cama_nome in _pending_mac_checks:
-                _pending_mac_checks[cama_nome].cancel()
-                del _pending_mac_checks[cama_nome]
-                print(f"[aggregator] Verificação de presença para '{cama_nome}' cancelada devido a evento 'OUT'.")
+            if _cancel_retry(cama_nome):
+                log.info("retry cancelado por OUT", cama=cama_nome)
             
             evt_out = next((e for e in events_for_bed if e.get("status") == "OUT"), events_for_bed[0])
             bed = db.query(Bed).filter(Bed.nome_cama == cama_nome).first()
             if bed and bed.quarto is not None:
-                print(f"[aggregator] Recebido 'OUT' para '{cama_nome}'. Removendo do quarto '{bed.quarto}'.")
+                log.info("OUT: removendo do quarto", cama=cama_nome, quarto=bed.quarto)
                 bed.quarto = None; db.commit()
                 dispatch_payload = evt_out.copy(); dispatch_payload.update({"quarto": None, "status": "OUT", "mac_address": bed.mac_address})
                 dispatch_event(dispatch_payload)
@@ -95,44 +126,41 @@ async def process_bed_events(cama_nome: str):
 
         # --- LÓGICA DE 'GET' ---
         best_event = min(events_for_bed, key=lambda e: e.get("RSSI", 1000))
-        print(f"[aggregator] FILTRO PARA '{cama_nome}': {len(events_for_bed)} eventos na disputa. "
-              f"Vencedor: ESP '{best_event['esp_id']}' com RSSI {best_event['RSSI']}.")
+        log.info("filtro", cama=cama_nome, eventos=len(events_for_bed),
+                 esp_id=best_event["esp_id"], rssi=best_event["RSSI"])
         
         esp_id = best_event["esp_id"]
         emb = db.query(Embarcado).filter(Embarcado.id_esp == esp_id).first()
         bed = db.query(Bed).filter(Bed.nome_cama == cama_nome).first()
 
         if not bed or not emb:
-            print(f"[aggregator] Cama ou ESP não cadastrado para {best_event}. Removendo.")
+            log.warning("cama ou ESP não cadastrado, removendo", evt=best_event)
             for ev in list(_buffer):
                 if ev.get("cama") == cama_nome: _buffer.remove(ev)
             return
 
         if check_presence(bed.mac_address):
-            if cama_nome in _pending_mac_checks:
-                _pending_mac_checks[cama_nome].cancel()
-                del _pending_mac_checks[cama_nome]
-                print(f"[aggregator] Cama '{cama_nome}' encontrada. Cancelando tarefa de retry pendente.")
+            if _cancel_retry(cama_nome):
+                log.info("cama encontrada, retry cancelado", cama=cama_nome)
 
             dispatch_payload = best_event.copy()
             if bed.quarto is None:
-                print(f"[aggregator] Associando '{cama_nome}' ao quarto '{emb.quarto}'.")
+                log.info("GET: associando ao quarto", cama=cama_nome, quarto=emb.quarto)
                 bed.quarto = emb.quarto; db.commit()
                 dispatch_payload.update({"quarto": bed.quarto, "status": "GET", "mac_address": bed.mac_address})
                 dispatch_event(dispatch_payload)
             elif bed.quarto != emb.quarto:
-                print(f"[aggregator] Conflito Ignorado: '{cama_nome}' já está em '{bed.quarto}', mas foi detectada em '{emb.quarto}'.")
+                log.info("conflito ignorado", cama=cama_nome, quarto=bed.quarto, detectado_em=emb.quarto)
             else:
-                print(f"[aggregator] Confirmação de '{cama_nome}' no quarto '{bed.quarto}'.")
+                log.debug("confirmação", cama=cama_nome, quarto=bed.quarto)
             
             # Limpa o buffer para esta cama, pois o estado foi consolidado.
             for ev in list(_buffer):
                 if ev.get("cama") == cama_nome: _buffer.remove(ev)
         else:
-            print(f"[aggregator] Presença de '{cama_nome}' não detectada. Iniciando monitorização em segundo plano.")
+            log.info("presença não detectada, iniciando retry", cama=cama_nome)
             if cama_nome not in _pending_mac_checks:
-                task = asyncio.create_task(retry_mac_check(cama_nome, best_event))
-                _pending_mac_checks[cama_nome] = task
+                _start_retry(cama_nome, best_event)
             
             # Limpa o buffer, transferindo a responsabilidade para a tarefa de retry.
             for ev in list(_buffer):
@@ -145,11 +173,116 @@ async def process_bed_events(cama_nome: str):
             _beds_in_process.remove(cama_nome)
 
 
+def snapshot():
+    """ Estado atual do agregador, para /api/state e assinantes ao vivo. """
+    from .nmap_scan import last_scan_timings
+    return {
+        "buffer": len(_buffer),
+        "beds_in_process": sorted(_beds_in_process),
+        "pending_retries": sorted(_pending_retry_events),
+        "scan_timings_ms": dict(last_scan_timings),
+    }
+
+
+# --- Checkpoint / warm restart ---
+def save_checkpoint(force: bool = False):
+    """
+    Grava em JSON compacto os retries pendentes e as leituras ainda no buffer.
+    Só escreve se o estado mudou desde o último checkpoint (ou com force).
+    A escrita é atômica (arquivo temporário + rename).
+    """
+    global _last_checkpoint, _last_checkpoint_at
+    state = json.dumps({"retries": _pending_retry_events, "buffer": _buffer},
+                       separators=(",", ":"), sort_keys=True, default=str)
+    if state == _last_checkpoint and not force:
+        _last_checkpoint_at = time.monotonic()
+        return
+    tmp = AGGREGATOR_CHECKPOINT_PATH + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write(f'{{"ts":{time.time()},"state":{state}}}')
+        os.replace(tmp, AGGREGATOR_CHECKPOINT_PATH)
+    except OSError as e:
+        log.warning("falha ao gravar checkpoint", path=AGGREGATOR_CHECKPOINT_PATH, erro=e)
+        return
+    _last_checkpoint, _last_checkpoint_at = state, time.monotonic()
+    log.debug("checkpoint gravado", retries=len(_pending_retry_events), buffer=len(_buffer))
+
+
+async def _resolve_restored_retries(camas):
+    """
+    Resolve de uma vez os retries restaurados: um único scan da rede, fora do
+    event loop, em vez de um check_presence síncrono por cama. As camas que não
+    aparecerem seguem no retry normal.
+    """
+    from .nmap_scan import get_connected_macs
+    try:
+        connected = await asyncio.to_thread(get_connected_macs, NETWORK_RANGES)
+    except Exception as e:
+        log.warning("scan dos retries restaurados falhou", erro=e)
+        return
+
+    found = 0
+    db = SessionLocal()
+    try:
+        for cama_nome in camas:
+            event_data = _pending_retry_events.get(cama_nome)
+            if event_data is None:
+                continue  # já resolvido por um evento novo enquanto o scan rodava
+            bed = db.query(Bed).filter(Bed.nome_cama == cama_nome).first()
+            if bed and bed.mac_address.lower() in connected:
+                _cancel_retry(cama_nome)
+                _associate_found_bed(db, cama_nome, bed, event_data)
+                found += 1
+    finally:
+        db.close()
+    log.info("retries restaurados verificados", camas=len(camas), encontradas=found)
+
+
+def restore_checkpoint():
+    """
+    Recarrega o checkpoint no startup. Os retries pendentes sempre voltam (não
+    ficam obsoletos) e são verificados juntos num único scan em background; as
+    leituras do buffer só voltam se o checkpoint tiver menos de
+    CHECKPOINT_MAX_AGE_SEC, para não reprocessar leituras obsoletas.
+    """
+    try:
+        with open(AGGREGATOR_CHECKPOINT_PATH) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        log.warning("checkpoint ilegível, ignorado", path=AGGREGATOR_CHECKPOINT_PATH, erro=e)
+        return
+
+    age = time.time() - data.get("ts", 0)
+    state = data.get("state", {})
+    buffer = state.get("buffer", [])
+    if age > CHECKPOINT_MAX_AGE_SEC:
+        log.info("leituras do checkpoint expiradas, ignoradas", idade_sec=round(age), buffer=len(buffer))
+        buffer = []
+    for evt in buffer:
+        enqueue_event(evt)
+
+    restored = []
+    for cama_nome, evt in state.get("retries", {}).items():
+        if cama_nome not in _pending_mac_checks:
+            _start_retry(cama_nome, evt)
+            restored.append(cama_nome)
+    if restored:
+        asyncio.create_task(_resolve_restored_retries(restored))
+    log.info("checkpoint restaurado", idade_sec=round(age), retries=len(restored), buffer=len(buffer))
+
+
 async def main_aggregator_loop():
     """ O loop principal que orquestra as tarefas. """
-    print("[aggregator] Agregador Orientado a Eventos iniciado.")
+    log.info("agregador orientado a eventos iniciado")
+    restore_checkpoint()
     while True:
         await asyncio.sleep(1)
+
+        if time.monotonic() - _last_checkpoint_at >= CHECKPOINT_INTERVAL_SEC:
+            save_checkpoint()
         
         pending_events_by_bed = defaultdict(list)
         for evt in _buffer:
@@ -11,7 +11,34 @@ NETWORK_RANGE = "10.0.0.0/24"
 
 NETWORK_PREFIX = "10.0.0."
 
+# Todas as redes varridas na verificação de presença, em paralelo.
+# Cada entrada é "cidr" ou "cidr@interface", ex.: ["10.0.0.0/24", "10.0.20.0/24@eth0.20"]
+NETWORK_RANGES = [NETWORK_RANGE]
+SCAN_SLOW_SUBNET_MS = 3000   # subnets mais lentas que isso são logadas (sem amostragem)
+
 # Historiador
 HISTORY_RETENTION_DAYS = 7       # mantém apenas 7 dias de eventos
 EVENT_PAGE_SIZE         = 50     # linhas por página em /events
-CLEANUP_INTERVAL_SEC    = 3600   # a cada hora roda a limpeza
\ No newline at end of file
+CLEANUP_INTERVAL_SEC    = 3600   # a cada hora roda a limpeza
+
+# Rollups de ocupação (sobrevivem ao HISTORY_RETENTION_DAYS)
+ROLLUP_BUCKET_SEC      = 3600   # granularidade dos rollups (1 hora)
+ROLLUP_FLUSH_SEC       = 60     # acumula em memória e grava no banco a cada minuto
+ROLLUP_RETENTION_DAYS  = 365    # mantém 1 ano de rollups
+
+# Checkpoint do agregador (warm restart)
+AGGREGATOR_CHECKPOINT_PATH = "./aggregator_state.json"
+CHECKPOINT_INTERVAL_SEC    = 5     # grava no máximo a cada 5s, e só se o estado mudou
+CHECKPOINT_MAX_AGE_SEC     = 600   # leituras do buffer mais velhas que isso são ignoradas no startup (retries sempre voltam)
+
+# Logging
+LOG_LEVEL          = "INFO"   # nível padrão de todos os módulos
+LOG_LEVELS         = {}       # níveis por módulo, ex.: {"app.nmap_scan": "WARNING"}
+LOG_QUEUE_SIZE     = 10000    # fila do writer em background (excedente é descartado)
+LOG_RATE_LIMIT_SEC = 10       # intervalo mínimo entre mensagens repetitivas iguais
+
+# Deploy multi-processo (python -m app.run): ingestão num processo, web em N workers
+WEB_HOST           = "0.0.0.0"
+WEB_PORT           = 8000
+WEB_WORKERS        = 3
+INGEST_SOCKET_PATH = "/tmp/wyrd_ingest.sock"   # IPC ingestão ↔ workers web
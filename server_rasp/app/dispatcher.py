@@ -4,6 +4,20 @@ import socket
 import json
 import time
 from .config import FINAL_IP, FINAL_PORT
+from .rollup import record_transition
+from .log import get_logger
+
+log = get_logger(__name__)
+
+# Ouvintes de eventos despachados (atualizações ao vivo; ver ipc.py)
+_listeners = []
+
+def add_listener(fn):
+    _listeners.append(fn)
+
+def remove_listener(fn):
+    if fn in _listeners:
+        _listeners.remove(fn)
 
 # Função de backoff exponencial para reconexão
 def exponential_backoff(attempt):
@@ -19,21 +33,28 @@ def dispatch_event(evt):
         "dataOn": evt.get("dataOn"),
         "wifi":   evt.get("wifi")
     }
+    record_transition(payload["cama"], payload["status"], payload["quarto"])
+    for fn in list(_listeners):
+        try:
+            fn(payload)
+        except Exception as e:
+            log.warning("ouvinte falhou", erro=e)
+
     msg = json.dumps(payload) + "\n"
-    print(f"[dispatch_event] Payload montado: {payload}")
+    log.info("payload montado", payload=payload)
 
     attempt = 0
     while attempt < 5:
         try:
             attempt += 1
-            print(f"[dispatch_event] Tentativa {attempt} de conexão em {FINAL_IP}:{FINAL_PORT}...")
+            log.debug("tentando conexão", tentativa=attempt, host=FINAL_IP, port=FINAL_PORT)
             with socket.create_connection((FINAL_IP, FINAL_PORT), timeout=5) as sock:
                 sock.sendall(msg.encode())
-                print(f"[dispatch_event] Payload enviado com sucesso na tentativa {attempt}.")
+                log.info("payload enviado", tentativa=attempt)
             break
         except (socket.timeout, socket.error) as e:
             wait = exponential_backoff(attempt)
-            print(f"[dispatch_event] Erro ao enviar (tentativa {attempt}): {e!r}. Aguardando {wait}s para retry.")
+            log.warning("erro ao enviar", tentativa=attempt, erro=e, espera_sec=wait)
             time.sleep(wait)
     else:
-        print(f"[dispatch_event] Falha após {attempt} tentativas. Payload descartado.")
+        log.error("payload descartado", tentativas=attempt, payload=payload)
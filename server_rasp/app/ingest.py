@@ -0,0 +1,105 @@
+# ingest.py
+#
+# Lado de ingestão/agregação: servidor TCP dos ESPs, agregador, rollups e
+# limpeza do historiador. Roda dentro do processo web (modo padrão, via
+# main.on_startup) ou num processo próprio (run.py), falando com os workers
+# web pelo socket Unix de ipc.py.
+
+import asyncio
+import signal
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from .aggregator import main_aggregator_loop, save_checkpoint
+from .config import HISTORY_RETENTION_DAYS, CLEANUP_INTERVAL_SEC
+from .models import SessionLocal, ReceivedEvent, init_db
+from .rollup import rollup_flush_loop, flush as flush_rollups, purge_old_rollups
+from .tcp_server import open_server
+from .log import get_logger, shutdown_logging
+
+# Nome explícito: com "python -m app.ingest" o __name__ é "__main__", fora da hierarquia "app"
+log = get_logger("app.ingest")
+
+
+# limpeza periódica usando data_on
+def purge_old_events():
+    db = SessionLocal()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=HISTORY_RETENTION_DAYS)
+    deleted = db.query(ReceivedEvent).filter(ReceivedEvent.data_on < cutoff).delete()
+    db.commit()
+    log.info("purge_old_events", removidos=deleted, cutoff=cutoff.isoformat())
+    # Rollups têm retenção própria (ROLLUP_RETENTION_DAYS)
+    purge_old_rollups()
+
+def start_cleanup_scheduler():
+    log.info("cleanup scheduler iniciado", intervalo_sec=CLEANUP_INTERVAL_SEC)
+    def loop():
+        while True:
+            purge_old_events()
+            time.sleep(CLEANUP_INTERVAL_SEC)
+    threading.Thread(target=loop, daemon=True).start()
+
+
+async def start_ingest():
+    """
+    Sobe servidor TCP, agregador, banco, rollups e limpeza no event loop atual.
+    Retorna a duração (ms) de cada etapa para o relatório de startup.
+    """
+    timings = {}
+    t = time.perf_counter()
+
+    # O listener TCP sobe primeiro, para os ESPs reconectarem o quanto antes;
+    # os eventos ficam no buffer do agregador até o resto do startup terminar.
+    tcp = await open_server()
+    asyncio.create_task(tcp.serve_forever())
+    timings["tcp_server_ms"] = round((time.perf_counter() - t) * 1000, 1)
+    t = time.perf_counter()
+
+    asyncio.create_task(main_aggregator_loop())
+    init_db()
+    asyncio.create_task(rollup_flush_loop())
+    timings["init_db_ms"] = round((time.perf_counter() - t) * 1000, 1)
+
+    start_cleanup_scheduler()
+    # Import do backend de presença (Scapy) em background, fora do event loop.
+    from .nmap_scan import preload
+    threading.Thread(target=preload, daemon=True).start()
+    return timings
+
+
+def stop_ingest():
+    """ Último checkpoint do agregador (warm restart) e flush dos rollups. """
+    save_checkpoint(force=True)
+    flush_rollups()
+
+
+async def _serve():
+    from .ipc import start_ipc_server
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    timings = await start_ingest()
+    ipc = await start_ipc_server()
+    log.info("processo de ingestão pronto", **timings)
+    try:
+        await stop.wait()
+    finally:
+        ipc.close()
+        stop_ingest()
+        log.info("processo de ingestão finalizado")
+
+
+def run():
+    """ Ponto de entrada do processo de ingestão separado (ver run.py). """
+    try:
+        asyncio.run(_serve())
+    finally:
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,170 @@
+# ipc.py
+#
+# Comunicação entre o processo de ingestão e os workers web por um socket Unix
+# local, com mensagens JSON por linha:
+#   {"cmd": "state"}                                  -> snapshot do agregador
+#   {"cmd": "transition", "cama", "status", "quarto"} -> registra nos rollups
+#   {"cmd": "subscribe"}                              -> snapshot + eventos despachados ao vivo
+# Sem processo de ingestão separado (modo padrão), as mesmas funções de cliente
+# acessam os módulos locais diretamente.
+
+import asyncio
+import json
+import os
+
+from .aggregator import snapshot
+from .config import INGEST_SOCKET_PATH
+from .dispatcher import add_listener, remove_listener
+from .rollup import record_transition
+from .log import get_logger
+
+log = get_logger(__name__)
+
+# Definido por run.py antes de subir os workers web
+INGEST_EXTERNAL = os.environ.get("WYRD_INGEST_EXTERNAL") == "1"
+
+_SUBSCRIBER_QUEUE_SIZE = 1000  # eventos acima disso são descartados para o assinante lento
+
+
+def _encode(msg):
+    return json.dumps(msg, default=str).encode() + b"\n"
+
+
+def _queue_listener(q):
+    def listener(payload):
+        if not q.full():
+            q.put_nowait(payload)
+    return listener
+
+
+async def _local_events():
+    """ Snapshot seguido dos eventos despachados neste processo. """
+    q = asyncio.Queue(maxsize=_SUBSCRIBER_QUEUE_SIZE)
+    listener = _queue_listener(q)
+    add_listener(listener)
+    try:
+        yield {"type": "state", **snapshot()}
+        while True:
+            yield {"type": "dispatch", "evt": await q.get()}
+    finally:
+        remove_listener(listener)
+
+
+# --- Servidor (processo de ingestão) ---
+async def _stream_events(reader, writer):
+    """ Envia snapshot e eventos despachados até o assinante desconectar. """
+    q = asyncio.Queue(maxsize=_SUBSCRIBER_QUEUE_SIZE)
+    listener = _queue_listener(q)
+    add_listener(listener)
+    # O assinante não envia mais nada depois do comando: EOF = desconectou
+    gone = asyncio.ensure_future(reader.read())
+    try:
+        writer.write(_encode({"type": "state", **snapshot()}))
+        await writer.drain()
+        while True:
+            get = asyncio.ensure_future(q.get())
+            done, _ = await asyncio.wait({get, gone}, return_when=asyncio.FIRST_COMPLETED)
+            if get not in done:
+                get.cancel()
+                return
+            writer.write(_encode({"type": "dispatch", "evt": get.result()}))
+            await writer.drain()
+    finally:
+        remove_listener(listener)
+        gone.cancel()
+
+
+async def handle_ipc(reader, writer):
+    try:
+        line = await reader.readline()
+        if not line:
+            return
+        msg = json.loads(line)
+        cmd = msg.get("cmd")
+
+        if cmd == "state":
+            writer.write(_encode(snapshot()))
+        elif cmd == "transition":
+            record_transition(msg["cama"], msg["status"], msg.get("quarto"))
+            writer.write(_encode({"ok": True}))
+        elif cmd == "subscribe":
+            await _stream_events(reader, writer)
+            return
+        else:
+            writer.write(_encode({"ok": False, "erro": f"comando desconhecido: {cmd}"}))
+        await writer.drain()
+    except (ConnectionResetError, BrokenPipeError, asyncio.CancelledError):
+        # Cliente caiu, ou o servidor está encerrando
+        pass
+    except (ValueError, KeyError) as e:
+        log.warning("mensagem IPC inválida", erro=e)
+    finally:
+        if not writer.is_closing():
+            writer.close()
+
+
+async def start_ipc_server():
+    # Remove socket órfão de uma execução anterior
+    if os.path.exists(INGEST_SOCKET_PATH):
+        os.unlink(INGEST_SOCKET_PATH)
+    server = await asyncio.start_unix_server(handle_ipc, path=INGEST_SOCKET_PATH)
+    log.info("servidor IPC rodando", path=INGEST_SOCKET_PATH)
+    return server
+
+
+# --- Cliente (workers web) ---
+# Com o processo de ingestão fora do ar (ou reiniciando) as funções abaixo não
+# levantam: logam um aviso e retornam None / encerram o stream.
+async def _request(msg):
+    try:
+        reader, writer = await asyncio.open_unix_connection(INGEST_SOCKET_PATH)
+    except OSError as e:
+        log.warning("processo de ingestão indisponível", cmd=msg.get("cmd"), erro=e)
+        return None
+    try:
+        writer.write(_encode(msg))
+        await writer.drain()
+        return json.loads(await reader.readline())
+    except (OSError, ValueError) as e:
+        log.warning("falha na requisição IPC", cmd=msg.get("cmd"), erro=e)
+        return None
+    finally:
+        writer.close()
+
+
+async def fetch_state():
+    """ Snapshot do agregador, ou None se a ingestão estiver indisponível. """
+    if not INGEST_EXTERNAL:
+        return snapshot()
+    return await _request({"cmd": "state"})
+
+
+async def send_transition(cama, status, quarto):
+    """ Registra a transição nos rollups; se a ingestão estiver fora, só loga. """
+    if not INGEST_EXTERNAL:
+        record_transition(cama, status, quarto)
+        return
+    await _request({"cmd": "transition", "cama": cama, "status": status, "quarto": quarto})
+
+
+async def subscribe():
+    """ Gerador assíncrono de atualizações ao vivo: snapshot e eventos despachados. """
+    if not INGEST_EXTERNAL:
+        async for evt in _local_events():
+            yield evt
+        return
+
+    try:
+        reader, writer = await asyncio.open_unix_connection(INGEST_SOCKET_PATH)
+    except OSError as e:
+        log.warning("processo de ingestão indisponível", cmd="subscribe", erro=e)
+        return
+    try:
+        writer.write(_encode({"cmd": "subscribe"}))
+        await writer.drain()
+        while line := await reader.readline():
+            yield json.loads(line)
+    except (OSError, ValueError) as e:
+        log.warning("stream IPC interrompido", erro=e)
+    finally:
+        writer.close()
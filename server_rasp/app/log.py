@@ -0,0 +1,184 @@
+# log.py
+#
+# Logging estruturado e não-bloqueante para os caminhos quentes (ingestão,
+# agregação, presença e despacho). As chamadas só colocam o LogRecord numa
+# fila; formatação e escrita no stdout acontecem numa thread em background.
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+from .config import LOG_LEVEL, LOG_LEVELS, LOG_QUEUE_SIZE, LOG_RATE_LIMIT_SEC
+
+_ROOT = "app"
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+
+
+class KeyValueFormatter(logging.Formatter):
+    """ Formata como `<data> <nível> <módulo> <mensagem> chave=valor ...`. """
+
+    def format(self, record):
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v!r}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Deixa passar no máximo uma mensagem por intervalo para cada (módulo, mensagem)
+    marcada com rate_limit. A próxima que passar carrega o total suprimido.
+    """
+
+    def __init__(self, interval_sec=LOG_RATE_LIMIT_SEC):
+        super().__init__()
+        self.interval_sec = interval_sec
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "rate_limit", False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._last.get(key, (0.0, 0))
+            if now - last < self.interval_sec:
+                self._last[key] = (last, suppressed + 1)
+                return False
+            self._last[key] = (now, 0)
+        if suppressed:
+            record.fields = dict(record.fields or {}, suppressed=suppressed)
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que nunca bloqueia quem loga: com a fila cheia o registro é
+    descartado, e o próximo que entrar na fila carrega o total descartado.
+    A formatação é adiada para o listener (prepare não formata), então os
+    campos passados não devem ser modificados depois do log.
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0  # descartados desde o último registro enfileirado
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # Chamado com o lock do handler: o contador não precisa de lock próprio
+        if self.dropped:
+            record.fields = dict(getattr(record, "fields", None) or {}, dropped=self.dropped)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        else:
+            self.dropped = 0
+
+
+class StructLogger:
+    """
+    Logger fino com campos chave/valor: `log.info("enqueue", cama=..., rssi=...)`.
+    Se o nível estiver desabilitado nada é montado nem formatado.
+    """
+
+    __slots__ = ("_logger",)
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def isEnabledFor(self, level):
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level, msg, fields, rate_limit=False, exc_info=None):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, msg, exc_info=exc_info,
+                             extra={"fields": fields, "rate_limit": rate_limit})
+
+    def debug(self, msg, rate_limit=False, **fields):
+        self._log(logging.DEBUG, msg, fields, rate_limit)
+
+    def info(self, msg, rate_limit=False, **fields):
+        self._log(logging.INFO, msg, fields, rate_limit)
+
+    def warning(self, msg, rate_limit=False, **fields):
+        self._log(logging.WARNING, msg, fields, rate_limit)
+
+    def error(self, msg, rate_limit=False, exc_info=None, **fields):
+        self._log(logging.ERROR, msg, fields, rate_limit, exc_info)
+
+
+def setup_logging():
+    """ Configura fila + writer em background uma única vez (idempotente). """
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(KeyValueFormatter())
+
+        q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _handler = DroppingQueueHandler(q)
+        _handler.addFilter(RateLimitFilter())
+
+        root = logging.getLogger(_ROOT)
+        root.setLevel(LOG_LEVEL)
+        root.addHandler(_handler)
+        root.propagate = False
+        for name, level in LOG_LEVELS.items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(q, stream)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def _restart_after_fork():
+    """
+    A thread do listener não sobrevive ao fork (ex.: processo de ingestão do
+    run.py); o filho ganha fila e listener novos sobre os mesmos handlers.
+    """
+    global _listener
+    if _listener is None:
+        return
+    atexit.unregister(_listener.stop)
+    q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _handler.queue = q
+    _listener = logging.handlers.QueueListener(q, *_listener.handlers)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def shutdown_logging():
+    """
+    Esvazia a fila e para o listener. Necessário em processos filhos do
+    multiprocessing, que saem sem rodar os handlers do atexit.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            atexit.unregister(_listener.stop)
+            _listener.stop()
+            _listener = None
+
+
+def get_logger(name):
+    """ Retorna o StructLogger do módulo, configurando o logging na primeira chamada. """
+    setup_logging()
+    return StructLogger(logging.getLogger(name))
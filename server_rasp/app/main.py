@@ -1,12 +1,12 @@
 # main.py
 
-import asyncio
-import threading
 import time
-import uvicorn
+_T0 = time.perf_counter()
 
+import asyncio
+import threading
 from fastapi import FastAPI, Request, Response, Form, HTTPException, Body
-from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
@@ -15,31 +15,39 @@ from datetime import datetime, timedelta, timezone
 import csv
 from io import StringIO
 import json
+from sqlalchemy import func
 
 from .models import (
     engine,
     SessionLocal,
     Bed,
     Embarcado,
-    ReceivedEvent,
-    init_db
+    ReceivedEvent
 )
 
 from .presence import check_presence
-from .aggregator import main_aggregator_loop, enqueue_event 
-from .tcp_server import start_server
+from .provisioning import parse_rows, upsert_beds, upsert_embarcados
+from .rollup import query_rollups
+from .ingest import start_ingest, stop_ingest
+from .ipc import INGEST_EXTERNAL, fetch_state, send_transition, subscribe
 from .auth import authenticate_admin
 from .config import (
-    HISTORY_RETENTION_DAYS,
     EVENT_PAGE_SIZE,
-    CLEANUP_INTERVAL_SEC
+    NETWORK_RANGES,
+    ROLLUP_BUCKET_SEC
 )
-from sqladmin import Admin, ModelView
+from .log import get_logger
+
+log = get_logger(__name__)
 
-print("[main] Módulo carregado")
+# Relatório de startup: duração (ms) de cada etapa, logado ao fim do on_startup.
+# Para o perfil completo de imports: python -X importtime -c "import app.main"
+_startup_timings = {"imports_ms": round((time.perf_counter() - _T0) * 1000, 1)}
+
+def _mark(stage, since):
+    _startup_timings[f"{stage}_ms"] = round((time.perf_counter() - since) * 1000, 1)
+    return time.perf_counter()
 
-# inicializa banco
-init_db()
 app = FastAPI()
 
 # protege /admin com HTTP Basic
@@ -59,23 +67,26 @@ async def protect_admin_routes(request: Request, call_next):
             )
     return await call_next(request)
 
-# sub-app do SQLAdmin
-admin_app = FastAPI()
-admin = Admin(admin_app, engine, base_url="/")
+# sub-app do SQLAdmin (montado no startup, depois que o servidor TCP já está no ar)
+def mount_admin():
+    from sqladmin import Admin, ModelView
+
+    admin_app = FastAPI()
+    admin = Admin(admin_app, engine, base_url="/")
 
-class BedAdmin(ModelView, model=Bed):
-    column_list = [Bed.id, Bed.mac_address, Bed.nome_cama, Bed.mac_beacon, Bed.quarto]
-    column_searchable_list = [Bed.mac_address, Bed.nome_cama, Bed.mac_beacon, Bed.quarto]
-    page_size = 20
+    class BedAdmin(ModelView, model=Bed):
+        column_list = [Bed.id, Bed.mac_address, Bed.nome_cama, Bed.mac_beacon, Bed.quarto]
+        column_searchable_list = [Bed.mac_address, Bed.nome_cama, Bed.mac_beacon, Bed.quarto]
+        page_size = 20
 
-class EmbarcadoAdmin(ModelView, model=Embarcado):
-    column_list = [Embarcado.id, Embarcado.id_esp, Embarcado.quarto]
-    column_searchable_list = [Embarcado.id_esp, Embarcado.quarto]
-    page_size = 20
+    class EmbarcadoAdmin(ModelView, model=Embarcado):
+        column_list = [Embarcado.id, Embarcado.id_esp, Embarcado.quarto]
+        column_searchable_list = [Embarcado.id_esp, Embarcado.quarto]
+        page_size = 20
 
-admin.add_view(BedAdmin)
-admin.add_view(EmbarcadoAdmin)
-app.mount("/admin", admin_app)
+    admin.add_view(BedAdmin)
+    admin.add_view(EmbarcadoAdmin)
+    app.mount("/admin", admin_app)
 
 # estáticos e templates
 app.mount("/static", StaticFiles(directory="app/web/static"), name="static")
@@ -162,33 +173,83 @@ def download_events_csv():
         headers={"Content-Disposition": "attachment; filename=events_history.csv"}
     )
 
-# limpeza periódica usando data_on
-def purge_old_events():
-    db = SessionLocal()
-    cutoff = datetime.now(timezone.utc) - timedelta(days=HISTORY_RETENTION_DAYS)
-    deleted = db.query(ReceivedEvent).filter(ReceivedEvent.data_on < cutoff).delete()
-    db.commit()
-    print(f"[main] purge_old_events: removidos {deleted} eventos antes de {cutoff.isoformat()}")
-
-def start_cleanup_scheduler():
-    print(f"[main] Cleanup scheduler iniciado (a cada {CLEANUP_INTERVAL_SEC}s)")
-    def loop():
-        while True:
-            purge_old_events()
-            time.sleep(CLEANUP_INTERVAL_SEC)
-    threading.Thread(target=loop, daemon=True).start()
-
 @app.on_event("startup")
 async def on_startup():
-    print("[main] Startup: agregador, servidor TCP e cleanup")
-    asyncio.create_task(main_aggregator_loop())
-    asyncio.create_task(start_server())
-    start_cleanup_scheduler()
+    # Com run.py a ingestão roda em processo próprio; aqui sobe só o web
+    if INGEST_EXTERNAL:
+        log.info("startup: worker web (ingestão em processo separado)")
+        # check_presence roda no worker: importa o Scapy em background, como start_ingest
+        from .nmap_scan import preload
+        threading.Thread(target=preload, daemon=True).start()
+    else:
+        log.info("startup: servidor TCP, agregador, banco, admin e cleanup")
+        _startup_timings.update(await start_ingest())
+    t = time.perf_counter()
+
+    mount_admin()
+    _mark("admin", t)
+
+    _startup_timings["total_ms"] = round((time.perf_counter() - _T0) * 1000, 1)
+    log.info("startup concluído", **_startup_timings)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if not INGEST_EXTERNAL:
+        stop_ingest()
 
 @app.get("/", name="main")
 def main(request: Request):
     return templates.TemplateResponse("main.html", {"request": request})
 
+# ─── ROLLUPS DE OCUPAÇÃO (JSON) ───────────────────────────────────────────────
+@app.get("/api/rollups", name="api_rollups")
+def api_rollups(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cama: Optional[str] = None,
+    quarto: Optional[str] = None
+):
+    """
+    Rollups de ocupação em [start, end) (ISO 8601, UTC se sem fuso; padrão:
+    últimos 7 dias), com totais por cama/quarto: GET/OUT, dwell e RSSI médio.
+    """
+    # Os buckets são gravados em UTC; datas sem fuso são tratadas como UTC
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=7)
+    start, end = (d.astimezone(timezone.utc) if d.tzinfo else d.replace(tzinfo=timezone.utc) for d in (start, end))
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start deve ser anterior a end.")
+
+    db = SessionLocal()
+    try:
+        rows, totals = query_rollups(db, start, end, cama=cama, quarto=quarto)
+    finally:
+        db.close()
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "bucket_sec": ROLLUP_BUCKET_SEC,
+        "totals": totals,
+        "rows": rows
+    }
+
+# ─── ESTADO DO AGREGADOR E ATUALIZAÇÕES AO VIVO ───────────────────────────────
+@app.get("/api/state", name="api_state")
+async def api_state():
+    """ Snapshot do agregador: buffer, camas em processamento e retries pendentes. """
+    state = await fetch_state()
+    if state is None:
+        raise HTTPException(status_code=503, detail="Processo de ingestão indisponível.")
+    return state
+
+@app.get("/api/live", name="api_live")
+async def api_live():
+    """ Server-Sent Events: snapshot inicial seguido de cada evento despachado. """
+    async def iter_sse():
+        async for evt in subscribe():
+            yield f"data: {json.dumps(evt, default=str)}\n\n"
+    return StreamingResponse(iter_sse(), media_type="text/event-stream")
+
 # ─── CRUD CAMAS ────────────────────────────────────────────────────────────────
 @app.get("/beds", name="list_beds")
 def list_beds(request: Request):
@@ -326,13 +387,111 @@ async def update_bed_from_json(data: dict = Body(...)):
         
         bed.quarto = quarto
         db.commit()
+        await send_transition(bed.nome_cama, "GET" if quarto else "OUT", quarto)
         
-        print(f"[main] Cama '{bed.nome_cama}' (MAC: {cama_mac}) atualizada para o quarto '{quarto}' com sucesso.")
+        log.info("cama atualizada", cama=bed.nome_cama, mac=cama_mac, quarto=quarto)
         
         return {"message": "Cama atualizada com sucesso", "cama": cama_mac, "status": status, "quarto": quarto}
     finally:
         db.close()
 
+# ─── PROVISIONAMENTO EM LOTE (JSON ou CSV) ────────────────────────────────────
+async def _bulk_upsert(request: Request, upsert):
+    try:
+        rows = parse_rows(await request.body(), request.headers.get("content-type"))
+    except (ValueError, csv.Error) as exc:
+        raise HTTPException(status_code=400, detail=f"Corpo inválido: {exc}")
+
+    db = SessionLocal()
+    try:
+        results, ok, transitions = upsert(db, rows)
+        if not ok:
+            db.rollback()
+            return JSONResponse(status_code=400, content={
+                "message": "Lote rejeitado: nenhuma linha gravada",
+                "errors": sum(r["status"] == "error" for r in results),
+                "results": results
+            })
+        db.commit()
+    finally:
+        db.close()
+
+    # Mudança de quarto pelo provisionamento também abre estadia nos rollups
+    for nome_cama, quarto in transitions:
+        await send_transition(nome_cama, "GET", quarto)
+    log.info("upsert em lote", path=request.url.path, linhas=len(results))
+    return {
+        "created": sum(r["status"] == "created" for r in results),
+        "updated": sum(r["status"] == "updated" for r in results),
+        "results": results
+    }
+
+@app.post("/api/beds/bulk", name="bulk_upsert_beds")
+async def bulk_upsert_beds(request: Request):
+    """
+    Upsert de camas por mac_address numa única transação. Corpo: array JSON ou
+    CSV (Content-Type: text/csv) com colunas mac/mac_address, nome/nome_cama,
+    mac_beacon e quarto. Se alguma linha for inválida, nada é gravado (400).
+    Camas que mudam de quarto são registradas nos rollups como GET.
+    """
+    return await _bulk_upsert(request, upsert_beds)
+
+@app.post("/api/embarcados/bulk", name="bulk_upsert_embarcados")
+async def bulk_upsert_embarcados(request: Request):
+    """ Upsert de embarcados por id_esp (colunas id_esp e quarto); mesmas regras de /api/beds/bulk. """
+    return await _bulk_upsert(request, upsert_embarcados)
+
+@app.post("/update_beds_from_json")
+async def update_beds_from_json(items: list = Body(...)):
+    """
+    Versão em lote de /update_bed_from_json: a presença de todas as camas é
+    verificada contra um único scan da rede e as camas encontradas são
+    atualizadas numa só transação. O resultado traz o status de cada item.
+    """
+    results = [None] * len(items)
+    pending = []
+    for i, data in enumerate(items):
+        if (not isinstance(data, dict) or not all(k in data for k in ("cama", "quarto", "status"))
+                or not isinstance(data["cama"], str)):
+            results[i] = {"index": i, "status_code": 400, "detail": "Dados da cama incompletos."}
+        else:
+            pending.append((i, data))
+
+    # Um único snapshot da rede para o lote inteiro, fora do event loop
+    from .nmap_scan import get_connected_macs
+    connected = await asyncio.to_thread(get_connected_macs, NETWORK_RANGES) if pending else {}
+
+    updated = []
+    db = SessionLocal()
+    try:
+        # Mesmo critério do provisionamento em lote: MAC sem diferenciar caixa
+        macs = {d["cama"].lower() for _, d in pending}
+        query = db.query(Bed).filter(func.lower(Bed.mac_address).in_(macs))
+        beds = {b.mac_address.lower(): b for b in query}
+        for i, data in pending:
+            cama_mac, quarto = data["cama"], data["quarto"]
+            bed = beds.get(cama_mac.lower())
+            if cama_mac.lower() not in connected:
+                results[i] = {"index": i, "cama": cama_mac, "status_code": 404,
+                              "detail": f"Cama com MAC {cama_mac} não está conectada à rede"}
+            elif not bed:
+                results[i] = {"index": i, "cama": cama_mac, "status_code": 404,
+                              "detail": f"Cama com MAC {cama_mac} não encontrada no banco de dados."}
+            else:
+                bed.quarto = quarto
+                updated.append((bed.nome_cama, quarto))
+                results[i] = {"index": i, "cama": cama_mac, "status_code": 200,
+                              "status": data["status"], "quarto": quarto}
+        db.commit()
+    finally:
+        db.close()
+
+    for nome_cama, quarto in updated:
+        await send_transition(nome_cama, "GET" if quarto else "OUT", quarto)
+    log.info("camas atualizadas em lote", itens=len(items), atualizadas=len(updated))
+    return {"updated": len(updated), "results": results}
+
 # ─── EXECUÇÃO DIRETA ───────────────────────────────────────────────────────────
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
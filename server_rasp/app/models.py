@@ -1,6 +1,6 @@
 # models.py
 
-from sqlalchemy import Column, Integer, String, DateTime, JSON, create_engine
+from sqlalchemy import Column, Integer, Float, String, DateTime, JSON, UniqueConstraint, create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
@@ -9,6 +9,16 @@ engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False}
 )
+
+# WAL: leitores (workers web) não bloqueiam o escritor (processo de ingestão)
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA busy_timeout=5000")
+    cur.close()
+
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
 Base = declarative_base()
 
@@ -38,5 +48,20 @@ class ReceivedEvent(Base):
     data_on  = Column(DateTime(timezone=True), nullable=False, index=True)
     raw      = Column(JSON, nullable=False)
 
+class OccupancyRollup(Base):
+    """ Agregado incremental por (intervalo, cama, quarto); ver rollup.py. """
+    __tablename__ = "occupancy_rollups"
+    id         = Column(Integer, primary_key=True, index=True)
+    bucket     = Column(DateTime(timezone=True), nullable=False, index=True)  # início do intervalo (UTC)
+    cama       = Column(String, nullable=False, index=True)
+    quarto     = Column(String, nullable=False, index=True)  # "" quando desconhecido
+    gets       = Column(Integer, nullable=False, default=0)
+    outs       = Column(Integer, nullable=False, default=0)
+    dwell_sec  = Column(Float, nullable=False, default=0.0)
+    readings   = Column(Integer, nullable=False, default=0)
+    rssi_sum   = Column(Integer, nullable=False, default=0)
+    rssi_count = Column(Integer, nullable=False, default=0)
+    __table_args__ = (UniqueConstraint("bucket", "cama", "quarto"),)
+
 def init_db():
     Base.metadata.create_all(bind=engine)
@@ -1,16 +1,43 @@
 # nmap_scan.py
 
+import ipaddress
 import subprocess
 import re
 import platform
-from datetime import datetime
-from .config import FINAL_IP, PORT, NETWORK_RANGE, NETWORK_PREFIX
-
-# Se estivermos no Linux/RaspPi, importe o Scapy
-if platform.system() != "Windows":
-    from scapy.all import ARP, Ether, srp
+import time
+from datetime import datetime, timezone
+from .config import FINAL_IP, PORT, NETWORK_RANGE, NETWORK_RANGES, NETWORK_PREFIX, SCAN_SLOW_SUBNET_MS
 
 from .models import SessionLocal, Bed
+from .log import get_logger
+
+log = get_logger(__name__)
+
+# -----------------------------------------------------------------------------
+# Import preguiçoso do Scapy: só ele leva vários segundos num Pi, então fica
+# fora do import do módulo e é carregado no primeiro scan (ou via preload()).
+# -----------------------------------------------------------------------------
+_scapy = None
+
+def _load_scapy():
+    global _scapy
+    if _scapy is None:
+        t0 = time.perf_counter()
+        import scapy.all as scapy_all
+        _scapy = scapy_all
+        log.info("Scapy carregado", ms=round((time.perf_counter() - t0) * 1000, 1))
+    return _scapy
+
+def preload():
+    """
+    Carrega o backend de scan antecipadamente (chamado em background depois que
+    o servidor TCP já está no ar), para que a primeira verificação não pague o import.
+    """
+    if platform.system() != "Windows":
+        try:
+            _load_scapy()
+        except Exception as e:
+            log.warning("preload do Scapy falhou", erro=e)
 
 # -----------------------------------------------------------------------------
 # Fallback Windows: ping sweep paralelo + arp -a
@@ -24,12 +51,13 @@ def _ping_ip(ip):
                    stdout=subprocess.DEVNULL,
                    stderr=subprocess.DEVNULL)
 
-def get_macs_via_arp_parallel(network_prefix=NETWORK_PREFIX):
+def get_macs_via_arp_parallel(network_prefix=NETWORK_PREFIX, network=None):
     """
     Faz um ping sweep em paralelo (50 threads) e depois lê arp -a
-    para capturar todos os MACs na cache ARP.
+    para capturar todos os MACs na cache ARP. Retorna {mac: ip}; com network,
+    só as entradas dessa rede (a cache ARP mistura todas as interfaces).
     """
-    print("[nmap_scan] Fallback Windows: ping sweep paralelo + arp -a…")
+    log.debug("fallback Windows: ping sweep paralelo + arp -a", prefix=network_prefix)
     ips = [f"{network_prefix}{i}" for i in range(1, 255)]
     with ThreadPoolExecutor(max_workers=50) as pool:
         pool.map(_ping_ip, ips)
@@ -42,59 +70,126 @@ def get_macs_via_arp_parallel(network_prefix=NETWORK_PREFIX):
     output = result.stdout
     #print(f"[nmap_scan] Saída do arp -a:\n{output}")
 
-    macs = re.findall(r"([0-9A-Fa-f]{2}(?:-[0-9A-Fa-f]{2}){5})", output)
-    # Converte '-' para ':' e lower
-    macs = [m.replace("-", ":").lower() for m in macs]
-    #print(f"[nmap_scan] MACs encontrados (ARP): {macs}")
-    return macs
+    net = ipaddress.ip_network(network, strict=False) if network else None
+    hosts = {}
+    for ip, mac in re.findall(r"(\d+\.\d+\.\d+\.\d+)\s+([0-9A-Fa-f]{2}(?:-[0-9A-Fa-f]{2}){5})", output):
+        if net is None or ipaddress.ip_address(ip) in net:
+            # Converte '-' para ':' e lower
+            hosts[mac.replace("-", ":").lower()] = ip
+    #print(f"[nmap_scan] MACs encontrados (ARP): {hosts}")
+    return hosts
 
 # -----------------------------------------------------------------------------
 # ARP‐scan rápido via Scapy (Linux/RaspPi)
 # -----------------------------------------------------------------------------
-def arp_scan_scapy(network=NETWORK_RANGE):
+def arp_scan_scapy(network=NETWORK_RANGE, iface=None):
     """
     Dispara um broadcast ARP via Scapy e captura todas as respostas.
-    Funciona em ~1–2 segundos num Linux/RaspPi.
+    Funciona em ~1–2 segundos num Linux/RaspPi. Retorna {mac: ip}.
     """
-    print(f"[nmap_scan] ARP‐scan via Scapy em {network}…")
-    pkt = Ether(dst="ff:ff:ff:ff:ff:ff")/ARP(pdst=network)
-    ans, _ = srp(pkt, timeout=2, verbose=False)
-    macs = [rcv[ARP].hwsrc.lower() for _, rcv in ans]
-    print(f"[nmap_scan] MACs encontrados (Scapy): {macs}")
-    return macs
+    scapy = _load_scapy()
+    log.debug("ARP-scan via Scapy", network=network, iface=iface)
+    pkt = scapy.Ether(dst="ff:ff:ff:ff:ff:ff")/scapy.ARP(pdst=network)
+    ans, _ = scapy.srp(pkt, timeout=2, verbose=False, iface=iface)
+    hosts = {rcv[scapy.ARP].hwsrc.lower(): rcv[scapy.ARP].psrc for _, rcv in ans}
+    log.debug("MACs encontrados (Scapy)", hosts=hosts)
+    return hosts
+
+# -----------------------------------------------------------------------------
+# Fallback nmap (Linux/RaspPi sem Scapy)
+# -----------------------------------------------------------------------------
+def nmap_scan(network=NETWORK_RANGE, iface=None):
+    """ Ping scan via nmap (precisa de root para reportar MACs). Retorna {mac: ip}. """
+    cmd = f"nmap -sn {network}" + (f" -e {iface}" if iface else "")
+    result = subprocess.run(cmd, shell=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.stderr:
+        log.warning("erro no nmap", stderr=result.stderr.strip())
+    output = result.stdout
+    log.debug("saída do nmap", output=output)
+
+    # Cada host vem como "Nmap scan report for [nome (]ip[)]" seguido, se
+    # estiver no mesmo segmento, de "MAC Address: AA:BB:...".
+    hosts, ip = {}, None
+    for line in output.splitlines():
+        m = re.match(r"Nmap scan report for (?:.*\()?([\d.]+)\)?", line)
+        if m:
+            ip = m.group(1)
+            continue
+        m = re.match(r"MAC Address: ([0-9A-Fa-f:]{17})", line)
+        if m and ip:
+            hosts[m.group(1).lower()] = ip
+    log.debug("MACs encontrados (nmap)", hosts=hosts)
+    return hosts
 
 # -----------------------------------------------------------------------------
 # Interface unificada
 # -----------------------------------------------------------------------------
-def get_connected_macs(network=NETWORK_RANGE):
+# Duração (ms) do último scan de cada subnet, para achar segmentos lentos
+# (exposto em /api/state via aggregator.snapshot)
+last_scan_timings = {}
+
+def _scan_hosts(network, iface=None):
     """
-    Retorna todos os MACs ativos na rede.
+    Retorna {mac: ip} de uma subnet.
     - No Windows: ping sweep paralelo + arp -a.
     - No Linux: ARP‐scan via Scapy; se falhar, tenta nmap.
     """
-    system = platform.system()
-    if system == "Windows":
-        prefix = network.rsplit(".", 1)[0] + "."
-        return get_macs_via_arp_parallel(network_prefix=prefix)
+    if platform.system() == "Windows":
+        prefix = network.split("/")[0].rsplit(".", 1)[0] + "."
+        return get_macs_via_arp_parallel(network_prefix=prefix, network=network)
 
     # Linux/RaspPi: tenta Scapy
     try:
-        return arp_scan_scapy(network)
+        return arp_scan_scapy(network, iface)
     except Exception as e:
-        print(f"[nmap_scan] Scapy falhou ({e}), tentando nmap…")
+        log.warning("Scapy falhou, tentando nmap", erro=e, network=network)
 
-    # Fallback para nmap
-    cmd = f"nmap -sn {network}"
-    result = subprocess.run(cmd, shell=True,
-                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if result.stderr:
-        print(f"[nmap_scan] Erro no nmap: {result.stderr.strip()}")
-    output = result.stdout
-    print(f"[nmap_scan] Saída do nmap:\n{output}")
+    return nmap_scan(network, iface)
+
+def _scan_subnet(entry):
+    """ Varre uma entrada "cidr" ou "cidr@interface" e cronometra. """
+    network, _, iface = entry.partition("@")
+    t0 = time.perf_counter()
+    try:
+        hosts = _scan_hosts(network, iface or None)
+    except Exception as e:
+        log.error("scan da subnet falhou", network=network, iface=iface, erro=e)
+        hosts = {}
+    ms = last_scan_timings[network] = round((time.perf_counter() - t0) * 1000, 1)
+    if ms > SCAN_SLOW_SUBNET_MS:
+        log.warning("subnet lenta", network=network, iface=iface or None, ms=ms, hosts=len(hosts))
+    seen = datetime.now(timezone.utc)
+    return {mac: (ip, network, seen) for mac, ip in hosts.items()}
+
+def get_connected_macs(networks=NETWORK_RANGES):
+    """
+    Retorna todos os MACs ativos nas redes, como {mac: (ip, subnet, last_seen)}.
+    Aceita uma rede ou uma lista; cada entrada é "cidr" ou "cidr@interface".
+    As subnets são varridas em paralelo, então o tempo total é o da mais lenta.
+    Um MAC visto em mais de uma subnet fica com a que vem primeiro na lista.
+    """
+    if isinstance(networks, str):
+        networks = [networks]
+
+    t0 = time.perf_counter()
+    if len(networks) == 1:
+        results = [_scan_subnet(networks[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=len(networks)) as pool:
+            results = list(pool.map(_scan_subnet, networks))
+
+    # pool.map preserva a ordem de `networks`: setdefault mantém a primeira subnet
+    table = {}
+    for hosts in results:
+        for mac, info in hosts.items():
+            table.setdefault(mac, info)
 
-    mac_addresses = re.findall(r"MAC Address: ([\\w:]+)", output)
-    print(f"[nmap_scan] MACs encontrados (nmap): {mac_addresses}")
-    return mac_addresses
+    subnets = [n.partition("@")[0] for n in networks]
+    log.info("scan concluído", rate_limit=True, hosts=len(table),
+             ms=round((time.perf_counter() - t0) * 1000, 1),
+             por_subnet={n: last_scan_timings.get(n) for n in subnets})
+    return table
 
 # -----------------------------------------------------------------------------
 # Se você quiser persistir no banco, pode implementar aqui:
@@ -1,14 +1,18 @@
 # presence
 
-from .nmap_scan import get_connected_macs
-from .config import NETWORK_RANGE
+from .config import NETWORK_RANGES
+from .log import get_logger
+
+log = get_logger(__name__)
 
 def check_presence(mac):
     """
-    Verifica se o MAC está presente na rede, via Nmap (ou fallback ARP).
+    Verifica se o MAC está presente em alguma das redes, via Nmap (ou fallback ARP).
     """
-    connected_macs = get_connected_macs(NETWORK_RANGE)
+    # Import tardio: o backend de scan só é carregado na primeira verificação.
+    from .nmap_scan import get_connected_macs
+    connected_macs = get_connected_macs(NETWORK_RANGES)
     presente = mac.lower() in connected_macs
-    print(f"[presence] MAC {mac} {'está' if presente else 'não está'} conectado.")
+    log.info("presença", mac=mac, presente=presente)
     #print(f"Dispositivos: {connected_macs}")
     return presente
@@ -0,0 +1,154 @@
+# provisioning.py
+#
+# Upsert em lote de camas e embarcados (ESPs) para provisionar uma ala
+# inteira de uma vez. O corpo pode ser um array JSON ou CSV com cabeçalho.
+# Todas as linhas são validadas antes de gravar; se alguma for inválida nada
+# é gravado, e o resultado traz o status de cada linha.
+
+import csv
+import json
+import re
+from io import StringIO
+
+from sqlalchemy import func
+
+from .models import Bed, Embarcado
+
+_MAC_RE = re.compile(r"^[0-9a-f]{2}(:[0-9a-f]{2}){5}$")
+
+# Nomes aceitos para cada coluna (os do formulário HTML e os do modelo)
+_BED_FIELDS = {"mac": "mac_address", "mac_address": "mac_address",
+               "nome": "nome_cama", "nome_cama": "nome_cama",
+               "mac_beacon": "mac_beacon", "quarto": "quarto"}
+_EMB_FIELDS = {"id_esp": "id_esp", "quarto": "quarto"}
+
+
+def parse_rows(body: bytes, content_type: str):
+    """
+    Converte o corpo da requisição em lista de dicts. CSV se o content-type
+    indicar, senão JSON (array de objetos). Levanta ValueError se mal formado.
+    """
+    text = body.decode("utf-8-sig")
+    if "csv" in (content_type or ""):
+        return list(csv.DictReader(StringIO(text)))
+    rows = json.loads(text)
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        raise ValueError("esperado um array JSON de objetos")
+    return rows
+
+
+def normalize_mac(mac):
+    return mac.strip().lower().replace("-", ":")
+
+
+def _clean(row, fields):
+    """ Mapeia aliases para as colunas do modelo; valores vazios contam como ausentes. """
+    out = {}
+    for key, value in row.items():
+        col = fields.get((key or "").strip())
+        if col is None:
+            continue
+        if isinstance(value, str):
+            value = value.strip()
+        if value not in (None, ""):
+            out[col] = value
+    return out
+
+
+def _non_string(data):
+    """ Primeiro campo cujo valor não é texto (ex.: número num array JSON), ou None. """
+    return next((col for col, value in data.items() if not isinstance(value, str)), None)
+
+
+def _apply(db, model, key, rows, validate, defaults, case_insensitive=False, track=None):
+    """
+    Valida todas as linhas e, se não houver erro, faz o upsert por `key` na
+    sessão (o commit fica com quem chamou). Retorna (resultados, ok, alterados),
+    onde alterados são os objetos cuja coluna `track` mudou (ou foi definida).
+    Com case_insensitive, linhas existentes casam por lower(key): o formulário
+    HTML grava o valor como digitado, e a coluna única diferencia caixa. A
+    coluna `key` de uma linha existente nunca é reescrita.
+    """
+    results, valid, seen, changed = [], [], set(), []
+    for i, row in enumerate(rows):
+        data = validate(row)
+        if isinstance(data, str):
+            results.append({"row": i, "status": "error", "detail": data})
+            continue
+        if data[key] in seen:
+            results.append({"row": i, "status": "error", "detail": f"{key} duplicado no lote: {data[key]}"})
+            continue
+        seen.add(data[key])
+        valid.append((i, data))
+        results.append(None)
+
+    if len(valid) != len(rows):
+        for i, data in valid:
+            results[i] = {"row": i, "status": "valid", key: data[key]}
+        return results, False, changed
+
+    column = getattr(model, key)
+    if case_insensitive:
+        query = db.query(model).filter(func.lower(column).in_(list(seen)))
+        existing = {getattr(o, key).lower(): o for o in query}
+    else:
+        existing = {getattr(o, key): o for o in db.query(model).filter(column.in_(list(seen)))}
+    for i, data in valid:
+        obj = existing.get(data[key])
+        if obj is None:
+            obj = model(**{**defaults, **data})
+            db.add(obj)
+            previous, status = None, "created"
+        else:
+            previous = getattr(obj, track) if track else None
+            for col, value in data.items():
+                if col != key:
+                    setattr(obj, col, value)
+            status = "updated"
+        if track and getattr(obj, track) != previous:
+            changed.append(obj)
+        results[i] = {"row": i, "status": status, key: data[key]}
+    return results, True, changed
+
+
+def _validate_bed(row):
+    data = _clean(row, _BED_FIELDS)
+    bad = _non_string(data)
+    if bad:
+        return f"{bad} deve ser texto"
+    if "mac_address" not in data:
+        return "mac_address obrigatório"
+    data["mac_address"] = normalize_mac(data["mac_address"])
+    if not _MAC_RE.match(data["mac_address"]):
+        return f"mac_address inválido: {data['mac_address']}"
+    if "nome_cama" not in data:
+        return "nome_cama obrigatório"
+    return data
+
+
+def _validate_embarcado(row):
+    data = _clean(row, _EMB_FIELDS)
+    bad = _non_string(data)
+    if bad:
+        return f"{bad} deve ser texto"
+    if "id_esp" not in data:
+        return "id_esp obrigatório"
+    if "quarto" not in data:
+        return "quarto obrigatório"
+    return data
+
+
+def upsert_beds(db, rows):
+    """
+    Upsert de camas por mac_address. Retorna (resultados por linha, ok,
+    transições), com (nome_cama, quarto) de cada cama que mudou de quarto,
+    para quem chamou registrar nos rollups depois do commit.
+    """
+    results, ok, moved = _apply(db, Bed, "mac_address", rows, _validate_bed, {"mac_beacon": "Nenhum"},
+                                case_insensitive=True, track="quarto")
+    return results, ok, [(bed.nome_cama, bed.quarto) for bed in moved]
+
+
+def upsert_embarcados(db, rows):
+    """ Upsert de embarcados por id_esp. Retorna (resultados por linha, ok, []). """
+    return _apply(db, Embarcado, "id_esp", rows, _validate_embarcado, {})
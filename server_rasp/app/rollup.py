@@ -0,0 +1,205 @@
+# rollup.py
+#
+# Rollups de ocupação mantidos incrementalmente: por (intervalo, cama, quarto)
+# guarda transições GET/OUT, tempo de permanência, número de leituras e soma de
+# RSSI. Os caminhos quentes só incrementam contadores em memória; o flush
+# periódico faz um upsert em lote na tabela occupancy_rollups.
+
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .models import SessionLocal, Bed, Embarcado, OccupancyRollup
+from .config import ROLLUP_BUCKET_SEC, ROLLUP_FLUSH_SEC, ROLLUP_RETENTION_DAYS
+from .log import get_logger
+
+log = get_logger(__name__)
+
+_UPSERT_CHUNK = 100  # linhas por INSERT (limite de variáveis do SQLite)
+_COUNTERS = ("gets", "outs", "dwell_sec", "readings", "rssi_sum", "rssi_count")
+
+# --- Acumuladores em memória ---
+# {(bucket_ts, cama, quarto): {contador: valor}}
+_pending = defaultdict(lambda: dict.fromkeys(_COUNTERS, 0))
+# Leituras ainda sem quarto resolvido {(bucket_ts, cama, esp_id): [n, rssi_sum, rssi_count]}
+_readings = defaultdict(lambda: [0, 0, 0])
+# Estadias em aberto {cama: (quarto, desde_ts)}; o dwell é creditado até o último flush
+_open_stays = {}
+
+
+def _bucket(ts):
+    return int(ts // ROLLUP_BUCKET_SEC) * ROLLUP_BUCKET_SEC
+
+
+def _add_dwell(cama, quarto, start, end):
+    """ Credita o intervalo [start, end) à estadia, dividindo entre os buckets. """
+    while start < end:
+        nxt = min(end, _bucket(start) + ROLLUP_BUCKET_SEC)
+        _pending[(_bucket(start), cama, quarto)]["dwell_sec"] += nxt - start
+        start = nxt
+
+
+def _close_stay(cama, ts):
+    stay = _open_stays.pop(cama, None)
+    if stay is None:
+        return None
+    quarto, since = stay
+    _add_dwell(cama, quarto, since, ts)
+    return quarto
+
+
+def record_reading(evt, ts=None):
+    """ Conta uma leitura recebida de um ESP (chamado na ingestão). """
+    cama, esp_id = evt.get("cama"), evt.get("esp_id")
+    if cama is None:
+        return
+    acc = _readings[(_bucket(ts or time.time()), cama, esp_id)]
+    acc[0] += 1
+    rssi = evt.get("RSSI")
+    if isinstance(rssi, (int, float)):
+        acc[1] += rssi
+        acc[2] += 1
+
+
+def record_transition(cama, status, quarto, ts=None):
+    """
+    Registra uma transição GET/OUT despachada. GET abre uma estadia no quarto
+    (fechando a anterior, se houver); OUT fecha a estadia aberta.
+    """
+    ts = ts or time.time()
+    previous = _close_stay(cama, ts)
+    if status == "GET" and quarto is not None:
+        _open_stays[cama] = (quarto, ts)
+        _pending[(_bucket(ts), cama, quarto)]["gets"] += 1
+    elif status == "OUT":
+        _pending[(_bucket(ts), cama, previous or quarto or "")]["outs"] += 1
+
+
+def seed_open_stays():
+    """ No startup, reabre as estadias das camas que já estão em algum quarto. """
+    now = time.time()
+    db = SessionLocal()
+    try:
+        for cama, quarto in db.query(Bed.nome_cama, Bed.quarto).filter(Bed.quarto.isnot(None)):
+            _open_stays.setdefault(cama, (quarto, now))
+    finally:
+        db.close()
+    log.info("estadias abertas restauradas", camas=len(_open_stays))
+
+
+def _restore_unflushed(pending, readings):
+    """ Devolve aos acumuladores vivos o que não foi gravado, para o próximo flush. """
+    for key, counters in pending.items():
+        acc = _pending[key]
+        for c in _COUNTERS:
+            acc[c] += counters[c]
+    for key, values in readings.items():
+        acc = _readings[key]
+        for i, v in enumerate(values):
+            acc[i] += v
+
+
+def flush():
+    """
+    Grava os acumuladores no banco (upsert somando aos valores existentes).
+    Se a escrita falhar (ex.: banco travado), os contadores voltam para a
+    memória e entram no próximo flush.
+    """
+    global _pending, _readings
+    now = time.time()
+    for cama, (quarto, since) in list(_open_stays.items()):
+        _add_dwell(cama, quarto, since, now)
+        _open_stays[cama] = (quarto, now)
+
+    pending, readings = _pending, _readings
+    _pending = defaultdict(lambda: dict.fromkeys(_COUNTERS, 0))
+    _readings = defaultdict(lambda: [0, 0, 0])
+    if not pending and not readings:
+        return
+
+    db = SessionLocal()
+    try:
+        if readings:
+            esp2quarto = dict(db.query(Embarcado.id_esp, Embarcado.quarto))
+            for (bucket, cama, esp_id), (n, rssi_sum, rssi_count) in readings.items():
+                acc = pending[(bucket, cama, esp2quarto.get(esp_id, ""))]
+                acc["readings"] += n
+                acc["rssi_sum"] += rssi_sum
+                acc["rssi_count"] += rssi_count
+            readings = {}  # já incorporadas em pending
+
+        rows = [
+            dict(counters, bucket=datetime.fromtimestamp(bucket, timezone.utc), cama=cama, quarto=quarto)
+            for (bucket, cama, quarto), counters in pending.items()
+        ]
+        for i in range(0, len(rows), _UPSERT_CHUNK):
+            stmt = sqlite_insert(OccupancyRollup).values(rows[i:i + _UPSERT_CHUNK])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["bucket", "cama", "quarto"],
+                set_={c: getattr(OccupancyRollup, c) + getattr(stmt.excluded, c) for c in _COUNTERS},
+            )
+            db.execute(stmt)
+        db.commit()
+        log.debug("rollups gravados", linhas=len(rows))
+    except Exception as e:
+        db.rollback()
+        _restore_unflushed(pending, readings)
+        log.error("falha ao gravar rollups, mantidos para o próximo flush", erro=e, linhas=len(pending))
+    finally:
+        db.close()
+
+
+def purge_old_rollups():
+    db = SessionLocal()
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(days=ROLLUP_RETENTION_DAYS)
+        deleted = db.query(OccupancyRollup).filter(OccupancyRollup.bucket < cutoff).delete()
+        db.commit()
+    finally:
+        db.close()
+    log.info("purge_old_rollups", removidos=deleted, cutoff=cutoff.isoformat())
+
+
+def query_rollups(db, start, end, cama=None, quarto=None):
+    """
+    Retorna as linhas de rollup em [start, end) e os totais por (cama, quarto),
+    já com o RSSI médio calculado.
+    """
+    q = db.query(OccupancyRollup).filter(OccupancyRollup.bucket >= start, OccupancyRollup.bucket < end)
+    if cama is not None:
+        q = q.filter(OccupancyRollup.cama == cama)
+    if quarto is not None:
+        q = q.filter(OccupancyRollup.quarto == quarto)
+
+    rows, totals = [], {}
+    for r in q.order_by(OccupancyRollup.bucket):
+        # SQLite devolve o datetime sem tz; os buckets são sempre UTC
+        bucket = r.bucket if r.bucket.tzinfo else r.bucket.replace(tzinfo=timezone.utc)
+        rows.append({
+            "bucket": bucket.isoformat(),
+            "cama": r.cama, "quarto": r.quarto,
+            "gets": r.gets, "outs": r.outs, "dwell_sec": round(r.dwell_sec, 1),
+            "readings": r.readings,
+            "rssi_mean": round(r.rssi_sum / r.rssi_count, 1) if r.rssi_count else None,
+        })
+        t = totals.setdefault((r.cama, r.quarto), dict.fromkeys(_COUNTERS, 0))
+        for c in _COUNTERS:
+            t[c] += getattr(r, c)
+
+    return rows, [
+        {"cama": c, "quarto": qt, "gets": t["gets"], "outs": t["outs"],
+         "dwell_sec": round(t["dwell_sec"], 1), "readings": t["readings"],
+         "rssi_mean": round(t["rssi_sum"] / t["rssi_count"], 1) if t["rssi_count"] else None}
+        for (c, qt), t in totals.items()
+    ]
+
+
+async def rollup_flush_loop():
+    """ Tarefa periódica de flush dos rollups. """
+    seed_open_stays()
+    while True:
+        await asyncio.sleep(ROLLUP_FLUSH_SEC)
+        flush()
@@ -0,0 +1,44 @@
+# run.py
+#
+# Ponto de entrada único do deploy multi-processo:
+#   python -m app.run
+# Sobe a ingestão (TCP + agregador + rollups) num processo próprio e o app
+# web em WEB_WORKERS workers do uvicorn, que leem o estado do SQLite (WAL) e
+# recebem atualizações ao vivo pelo socket Unix (ver ipc.py).
+
+import multiprocessing
+import os
+
+import uvicorn
+
+from .config import WEB_HOST, WEB_PORT, WEB_WORKERS
+from .models import engine, init_db
+from .log import get_logger
+
+# Nome explícito: com "python -m app.run" o __name__ é "__main__", fora da hierarquia "app"
+log = get_logger("app.run")
+
+
+def main():
+    # Cria as tabelas uma vez, antes de qualquer processo abrir o banco
+    init_db()
+    # Não deixa conexão SQLite no pool para o filho herdar pelo fork
+    engine.dispose()
+
+    from .ingest import run as run_ingest
+    ingest = multiprocessing.Process(target=run_ingest, name="wyrd-ingest")
+    ingest.start()
+    log.info("processo de ingestão iniciado", pid=ingest.pid)
+
+    # Os workers web herdam a variável e não sobem TCP/agregador próprios
+    os.environ["WYRD_INGEST_EXTERNAL"] = "1"
+    try:
+        uvicorn.run("app.main:app", host=WEB_HOST, port=WEB_PORT, workers=WEB_WORKERS)
+    finally:
+        ingest.terminate()
+        ingest.join(10)
+        log.info("processo de ingestão encerrado", exitcode=ingest.exitcode)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,12 @@ import json
 from datetime import datetime, timezone
 
 from .aggregator import enqueue_event
+from .rollup import record_reading
 from .models import SessionLocal, ReceivedEvent
 from .config import IP, PORT
+from .log import get_logger
+
+log = get_logger(__name__)
 
 HOST = IP
 
@@ -27,31 +31,32 @@ async def handle_client(reader, writer):
                 line, buffer = buffer.split(b"\n", 1)
                 try:
                     evt = json.loads(line.decode())
-                    print(f"[tcp_server] JSON recebido de {peer_ip}: {evt}")
+                    log.info("JSON recebido", rate_limit=True, peer=peer_ip, evt=evt)
 
                     # Adiciona ao histórico (código existente)
                     db = SessionLocal()
                     # ... (código para salvar no ReceivedEvent)
                     db.close()
 
-                    # Enfileira para o agregador
+                    # Enfileira para o agregador e conta a leitura nos rollups
                     enqueue_event(evt)
+                    record_reading(evt)
                     #print(f"[tcp_server] Evento enviado ao agregador")
 
                     # Responde ao cliente
                     writer.write(b"Evento recebido e processado\n")
                     await writer.drain()
-                    print(f"[tcp_server] Resposta enviada a {peer_ip}")
+                    log.debug("resposta enviada", peer=peer_ip)
 
                 except json.JSONDecodeError:
-                    print(f"[tcp_server] JSON inválido de {peer_ip}: {line.decode()}")
+                    log.warning("JSON inválido", rate_limit=True, peer=peer_ip, line=line)
                 except Exception as e:
-                    print(f"[tcp_server] Erro ao processar dados de {peer_ip}: {e}")
+                    log.error("erro ao processar dados", peer=peer_ip, erro=e)
     
     # --- INÍCIO DA CORREÇÃO ---
     except (ConnectionResetError, asyncio.CancelledError, ConnectionAbortedError) as e:
         # Apenas regista que o cliente desconectou de forma inesperada.
-        print(f"[tcp_server] Conexão com {peer_ip} fechada abruptamente: {type(e).__name__}")
+        log.info("conexão fechada abruptamente", peer=peer_ip, motivo=type(e).__name__)
     finally:
         # Tenta fechar o writer de forma segura
         if not writer.is_closing():
@@ -62,9 +67,14 @@ async def handle_client(reader, writer):
                 pass # Ignora erros que possam acontecer aqui também
         #print(f"[tcp_server] Conexão com {peer_ip} finalizada")
 
-async def start_server():
+async def open_server():
+    """ Faz o bind e já começa a aceitar conexões; retorna o asyncio.Server. """
     server = await asyncio.start_server(handle_client, HOST, PORT)
-    print(f"[tcp_server] Servidor TCP rodando em {HOST}:{PORT}")
+    log.info("servidor TCP rodando", host=HOST, port=PORT)
+    return server
+
+async def start_server():
+    server = await open_server()
     async with server:
         await server.serve_forever()
 